@@ -0,0 +1,167 @@
+from pxr import Usd, Sdf, Gf, UsdGeom
+from .ExtractMeshes import ExtractMeshes
+from .CropTextures import CropTextures
+from .ValidateMeshes import ValidateMeshes
+
+# Where VRoid Studio characters end up after converting the GLB file to USD.
+CHARACTER_ROOT_PATHS = ['/World/Root']
+
+
+# Open just the characters in a USD file, for running the clean up outside of Kit (e.g. in batch runs).
+# Imported scenes can have environment layers and payloads the clean up never looks at, so the stage is
+# opened with a population mask of the character roots, expanded to pull in what they point at
+# (skeletons, materials, etc), and only payloads under the character roots are loaded.
+def open_character_stage(file_path, character_root_paths=CHARACTER_ROOT_PATHS) -> Usd.Stage:
+    mask = Usd.StagePopulationMask()
+    load_rules = Usd.StageLoadRules.LoadNone()
+    for path in character_root_paths:
+        mask.Add(Sdf.Path(path))
+        load_rules.LoadWithDescendants(Sdf.Path(path))
+    stage: Usd.Stage = Usd.Stage.OpenMasked(file_path, mask, Usd.Stage.LoadNone)
+    stage.SetLoadRules(load_rules)
+    stage.ExpandPopulationMask()
+    return stage
+
+
+# Clean up the characters in a USD file without Kit, saving the changes back to the file.
+# Returns the mesh validation reports.
+def clean_up_file(file_path, crop_textures=False, optimize_vertex_cache=False, validate=True):
+    stage = open_character_stage(file_path)
+    reports = CleanUp(stage, crop_textures, optimize_vertex_cache, validate).clean_up()
+    stage.Save()
+    return reports
+
+
+# The clean up steps for a VRoid Studio character, using only USD so it can run inside or outside of Kit.
+class CleanUp:
+
+    def __init__(self, stage: Usd.Stage, crop_textures=False, optimize_vertex_cache=False, validate=True):
+        self.stage = stage
+        self.crop_textures = crop_textures
+        self.optimize_vertex_cache = optimize_vertex_cache
+        self.validate = validate
+        self.validation_reports = []
+
+    # The main body of the clean up code for VRoid Studio characters.
+    # Returns the validation report of each mesh checked.
+    def clean_up(self):
+
+        # VRoid Studio dependent code. This code has hard coded path names used by VRoid Studio characters.
+        # If needed, could clean this up to make more generic.
+        # But I am also hoping NVIDIA fix their GLB import code, so trying to minimize my effort.
+
+        # The problem is the bone structure is it picks one level too deep for the bone hierarchy.
+        # /World/Root/J_Bip_C_Hips0/Skeleton/J_Bip_C_Hips/... should have been one node higher, so Root was
+        # included under Skeleton. Without this, it thinks the Hips are the root bone (at height zero).
+        # To work around the problem, I go through all the joint lists and insert "Root/" at the start
+        # of the joint paths.
+
+        stage = self.stage
+
+        # TODO: May have a go at this again, moving everything up so its Root/Skeleton without the hips.
+        # root_prim = stage.GetPrimAtPath('/World/Root')
+        # root_prim.SetTypeName('SkelRoot')
+
+        # Move Skeleton directly under Root layer
+        # self.move_if_necessary(stage, '/World/Root/J_Bip_C_Hips0/Skeleton', '/World/Root/Skeleton')
+
+        # Move meshes directly under Root layer, next to Skeleton
+        # self.move_if_necessary(stage, '/World/Root/J_Bip_C_Hips0/Face_baked', '/World/Root/Face_baked')
+        # self.move_if_necessary(stage, '/World/Root/J_Bip_C_Hips0/Body_baked', '/World/Root/Body_baked')
+        # self.move_if_necessary(stage, '/World/Root/J_Bip_C_Hips0/Hair001_baked', '/World/Root/Hair001_baked')
+
+        # Patch the skeleton structure, if not done already. Add "Root" to the joint list.
+        skeleton_prim = stage.GetPrimAtPath('/World/Root/J_Bip_C_Hips0/Skeleton')
+        if skeleton_prim:
+            self.add_parent_to_skeleton_joint_list(skeleton_prim, 'Root')
+
+        new_meshes = []
+        for child in stage.GetPrimAtPath('/World/Root/J_Bip_C_Hips0').GetChildren():
+            if child.IsA(UsdGeom.Mesh):
+                self.add_parent_to_mesh_joint_list(child, 'Root')
+                # self.split_disconnected_meshes(stage, child)
+
+                # Check (and repair) the mesh before extracting anything from it.
+                if self.validate:
+                    report = ValidateMeshes(stage).validate_mesh(child)
+                    self.validation_reports.append(report)
+                    if not report['ok']:
+                        print("[ordinary] Skipping " + report['mesh'] + ": " + ", ".join(report['errors']))
+                        continue
+
+                if child.GetName().startswith("Face_"):
+                    e = ExtractMeshes(stage, self.optimize_vertex_cache)
+                    e.extract_face_meshes(child)
+                    new_meshes += e.created_meshes
+                if child.GetName().startswith("Hair"):
+                    e = ExtractMeshes(stage, self.optimize_vertex_cache)
+                    e.extract_hair_meshes(child)
+                    new_meshes += e.created_meshes
+                if child.GetName().startswith("Body_"):
+                    e = ExtractMeshes(stage, self.optimize_vertex_cache)
+                    e.extract_body_meshes(child)
+                    new_meshes += e.created_meshes
+
+        # Optionally crop the shared texture atlas down to what each new mesh actually uses.
+        if self.crop_textures:
+            CropTextures(stage).crop_meshes(new_meshes)
+
+        # Delete the dangling node (was old SkelRoot)
+        # self.delete_if_no_children(stage, '/World/Root/J_Bip_C_Hips0')
+
+        # Delete old skeleton if present.
+        if stage.GetPrimAtPath('/World/Root/J_Bip_C_Hips0/Skeleton/J_Bip_C_Hips'):
+            self.delete_prim(Sdf.Path('/World/Root/J_Bip_C_Hips0/Skeleton/J_Bip_C_Hips'))
+
+        return self.validation_reports
+
+    # Delete a prim. Inside Kit this is replaced with the DeletePrims command.
+    def delete_prim(self, path: Sdf.Path):
+        self.stage.RemovePrim(path)
+
+    def add_parent_to_skeleton_joint_list(self, skeleton_prim: Usd.Prim, parent_name):
+        """
+        A skeleton has 3 attributes:
+        - uniform matrix4d[] bindTransforms = [( (1, 0, -0, 0), ...]
+        - uniform token[] joints = ["J_Bip_C_Hips", ...]
+        - uniform matrix4d[] restTransforms = [( (1, 0, -0, 0), ...]
+
+        In Omniverse Code etc, you can hover over the names in the "Raw USD Property" panel to get
+        more documentation on the above properties.
+
+        We need to insert the new parent at the front of the three lists, and prepend the name to the join paths.
+        """
+
+        # Get the attributes
+        joints: Usd.Attribute = skeleton_prim.GetAttribute('joints')
+        bindTransforms: Usd.Attribute = skeleton_prim.GetAttribute('bindTransforms')
+        restTransforms: Usd.Attribute = skeleton_prim.GetAttribute('restTransforms')
+
+        # If first join is the parent name already, nothing to do.
+        if joints.Get()[0] == parent_name:
+            return False
+
+        # TODO: I use raw USD functions here, but there is also omni.kit.commands.execute("ChangeProperty",...)
+        # if want undo...
+        # https://docs.omniverse.nvidia.com/prod_kit/prod_kit/programmer_ref/usd/properties/set-attribute.html#omniverse-kit-commands
+        joints.Set([parent_name] + [parent_name + '/' + jp for jp in joints.Get()])
+
+        # Insert unity matrix at the start for the root node we added.
+        # ((1, 0, 0, 0), (0, 1, 0, 0), (0, 0, 1, 0), (0, 0, 0, 1))
+        unity_matrix = Gf.Matrix4d(1, 0, 0, 0, 0, 1, 0, 0, 0, 0, 1, 0, 0, 0, 0, 1)
+        if bindTransforms.IsValid():
+            bindTransforms.Set([unity_matrix] + [x for x in bindTransforms.Get()])
+        if restTransforms.IsValid():
+            restTransforms.Set([unity_matrix] + [x for x in restTransforms.Get()])
+
+    # The meshes have paths to bones as well - add "Root" to their paths as well.
+    def add_parent_to_mesh_joint_list(self, mesh_prim, parent_name):
+        if mesh_prim:
+            joints: Usd.Attribute = mesh_prim.GetAttribute('skel:joints')
+
+            # Don't touch empty string. Don't add if already added. First value might be empty string.
+            if not joints.Get()[1].startswith(parent_name):
+                joints.Set([jp if jp == "" else parent_name + '/' + jp for jp in joints.Get()])
+                return True
+        return False
+
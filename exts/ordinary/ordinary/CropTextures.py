@@ -0,0 +1,152 @@
+import os
+import math
+from pxr import Usd, Sdf, Vt, UsdGeom, UsdShade
+import numpy as np
+
+# Pillow is used to do the cropping. If it is not available, the cropping is skipped.
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
+
+# VRoid Studio packs lots of parts (eyelashes, eyebrows, irises, teeth, etc) into one big texture atlas.
+# After the meshes are extracted, each one still uses the whole atlas even though its UVs only cover a
+# small region. This class crops the texture down to the region a mesh uses, writes it to a new file
+# next to the original, gives the mesh its own copy of the material pointing at the cropped texture,
+# and rewrites the UVs of the mesh to match.
+class CropTextures:
+
+    def __init__(self, stage: Usd.Stage, margin_pixels=4, max_area_ratio=0.75):
+        self.stage = stage
+        # Extra pixels kept around the UV region so texture filtering does not bleed in from outside.
+        self.margin_pixels = margin_pixels
+        # Don't bother cropping if the crop would still be most of the original texture.
+        self.max_area_ratio = max_area_ratio
+
+    # Crop the textures of all the given meshes. Returns the number of meshes changed.
+    def crop_meshes(self, meshes):
+        if Image is None:
+            print("[ordinary] PIL not available, skipping texture cropping")
+            return 0
+        n = 0
+        for mesh in meshes:
+            if self.crop_mesh_textures(mesh):
+                n += 1
+        return n
+
+    # Crop the textures used by the material bound to one mesh. Returns true if the mesh was changed.
+    def crop_mesh_textures(self, mesh: UsdGeom.Mesh):
+        st_primvar = UsdGeom.PrimvarsAPI(mesh).GetPrimvar('st')
+        if not st_primvar or not st_primvar.HasValue():
+            return False
+        st = np.asarray(st_primvar.Get(), dtype=np.float64).reshape(-1, 2)
+        if len(st) == 0:
+            return False
+
+        # Textures that wrap around (UVs outside 0..1) cannot be cropped.
+        (u0, v0) = st.min(axis=0)
+        (u1, v1) = st.max(axis=0)
+        if u0 < 0.0 or v0 < 0.0 or u1 > 1.0 or v1 > 1.0:
+            return False
+
+        targets = UsdShade.MaterialBindingAPI(mesh).GetDirectBindingRel().GetTargets()
+        if len(targets) == 0:
+            return False
+        material_path: Sdf.Path = targets[0]
+        texture_inputs = self.find_texture_inputs(self.stage.GetPrimAtPath(material_path))
+        if len(texture_inputs) == 0:
+            return False
+
+        # Every texture has to be a local file we can crop, otherwise the cropped UVs would be
+        # used with the whole atlas.
+        image_paths = [self.local_image_path(texture_input.Get()) for texture_input in texture_inputs]
+        if None in image_paths:
+            return False
+
+        # Work out the crop box in UV space, snapped to the pixels of the first texture.
+        with Image.open(image_paths[0]) as image:
+            (width, height) = image.size
+        x0 = max(0, math.floor(u0 * width) - self.margin_pixels)
+        x1 = min(width, math.ceil(u1 * width) + self.margin_pixels)
+        y0 = max(0, math.floor((1.0 - v1) * height) - self.margin_pixels)
+        y1 = min(height, math.ceil((1.0 - v0) * height) + self.margin_pixels)
+        if x1 <= x0 or y1 <= y0 or (x1 - x0) * (y1 - y0) > self.max_area_ratio * width * height:
+            return False
+        box = (x0 / width, y0 / height, x1 / width, y1 / height)
+
+        # Give the mesh its own copy of the material, so other meshes sharing it are not affected.
+        new_material_path = self.copy_material(material_path, mesh.GetPath().name)
+        if new_material_path is None:
+            return False
+
+        # Write the cropped textures and point the copied material at them.
+        cropped = {}
+        for texture_input in self.find_texture_inputs(self.stage.GetPrimAtPath(new_material_path)):
+            asset: Sdf.AssetPath = texture_input.Get()
+            image_path = self.local_image_path(asset)
+            if image_path is None:
+                continue
+            if image_path not in cropped:
+                cropped[image_path] = self.crop_image(image_path, box, mesh.GetPath().name)
+            (head, _) = os.path.split(asset.path)
+            texture_input.Set(Sdf.AssetPath(head + '/' + cropped[image_path] if head else cropped[image_path]))
+        if len(cropped) == 0:
+            return False
+        UsdShade.MaterialBindingAPI(mesh).GetDirectBindingRel().SetTargets([new_material_path])
+
+        # Rewrite the UVs to the cropped region (V goes up in USD, but rows go down in the image).
+        (bu0, by0, bu1, by1) = box
+        new_st = np.empty_like(st)
+        new_st[:, 0] = (st[:, 0] - bu0) / (bu1 - bu0)
+        new_st[:, 1] = ((st[:, 1] - (1.0 - by1)) / (by1 - by0))
+        st_primvar.Set(Vt.Vec2fArray.FromNumpy(new_st.astype(np.float32)))
+        return True
+
+    # Return the shader inputs under the material that hold texture file asset paths.
+    def find_texture_inputs(self, material_prim: Usd.Prim):
+        texture_inputs = []
+        for prim in Usd.PrimRange(material_prim):
+            if prim.IsA(UsdShade.Shader):
+                for shader_input in UsdShade.Shader(prim).GetInputs():
+                    if shader_input.GetTypeName() == Sdf.ValueTypeNames.Asset and shader_input.Get():
+                        if shader_input.GetBaseName() not in ('mdl', 'sourceAsset'):
+                            texture_inputs.append(shader_input)
+        return texture_inputs
+
+    # Return the local file name of the image, or None if it is not a local file we can read.
+    def local_image_path(self, asset: Sdf.AssetPath):
+        if asset is None or not asset.resolvedPath or not os.path.isfile(asset.resolvedPath):
+            return None
+        return asset.resolvedPath
+
+    # Copy the material prim spec to a new prim next to it named after the mesh.
+    # Returns the new material path, or None if the material is not in the current edit target layer.
+    def copy_material(self, material_path: Sdf.Path, mesh_name):
+        layer: Sdf.Layer = self.stage.GetEditTarget().GetLayer()
+        if not layer.GetPrimAtPath(material_path):
+            return None
+        new_material_path = material_path.GetParentPath().AppendChild(material_path.name + '_' + mesh_name)
+        if not Sdf.CopySpec(layer, material_path, layer, new_material_path):
+            return None
+
+        # If the stage was opened with a population mask (see open_character_stage()), the new material is
+        # outside it, so add it to the mask or the stage will not show it.
+        mask: Usd.StagePopulationMask = self.stage.GetPopulationMask()
+        if not mask.IncludesSubtree(new_material_path):
+            self.stage.SetPopulationMask(mask.GetUnion(new_material_path))
+        if not self.stage.GetPrimAtPath(new_material_path):
+            return None
+        return new_material_path
+
+    # Crop the image to the box (in 0..1 image coordinates) and save it next to the original.
+    # Returns the file name (no directory) of the new image.
+    def crop_image(self, image_path, box, mesh_name):
+        (root, ext) = os.path.splitext(image_path)
+        new_image_path = root + '_' + mesh_name + ext
+        with Image.open(image_path) as image:
+            (width, height) = image.size
+            (bx0, by0, bx1, by1) = box
+            pixel_box = (round(bx0 * width), round(by0 * height), round(bx1 * width), round(by1 * height))
+            image.crop(pixel_box).save(new_image_path)
+        return os.path.basename(new_image_path)
@@ -1,11 +1,11 @@
-import typing
-import omni.ext
-import omni.ui as ui
-import omni.kit.commands
 from pxr import Usd, Sdf, Gf, UsdGeom, UsdShade, UsdSkel
 from .MeshMaker import MeshMaker
+import numpy as np
 import math
 
+# Attributes of the old mesh that may be animated, and whether they have a value per 'point' or per face 'corner'.
+TIME_SAMPLED_ATTRIBUTES = [('points', 'point'), ('normals', 'corner')]
+
 # Good resource https://github.com/NVIDIA-Omniverse/USD-Tutorials-And-Examples/blob/main/ColaboratoryNotebooks/usd_introduction.ipynb
 # Also https://docs.omniverse.nvidia.com/prod_kit/prod_kit/programmer_ref/usd/transforms/get-world-transforms.html
 
@@ -28,9 +28,12 @@ import math
 
 class ExtractMeshes:
     
-    def __init__(self, stage: Usd.Stage):
+    def __init__(self, stage: Usd.Stage, optimize_vertex_cache=False):
         self.stage = stage
+        self.optimize_vertex_cache = optimize_vertex_cache
         self.segment_map = None
+        self.created_meshes = []
+        self.time_samples_cache = {}
     
     # Return true if this Mesh is the Face mesh we want to convert.
     # Names are like "Face_baked" and "Face__merged__Clone_".
@@ -82,7 +85,7 @@ class ExtractMeshes:
                 skelJoints = UsdSkel.BindingAPI(old_mesh).GetJointsAttr().Get()
                 new_mesh = MeshMaker(self.stage, material, skeleton, skelJoints)
                 self.copy_subset(new_mesh, old_mesh, child)
-                new_mesh.create_at_path(old_mesh.GetPath().GetParentPath().AppendChild('hair_' + str(n)))
+                self.create_mesh(new_mesh, old_mesh.GetPath().GetParentPath().AppendChild('hair_' + str(n)))
                 n += 1
 
     def extract_body_meshes(self, old_mesh: UsdGeom.Mesh):
@@ -107,7 +110,7 @@ class ExtractMeshes:
                 else:
                     new_name = 'body_' + str(n)
                     n += 1
-                new_mesh.create_at_path(old_mesh.GetPath().GetParentPath().AppendChild(new_name))
+                self.create_mesh(new_mesh, old_mesh.GetPath().GetParentPath().AppendChild(new_name))
 
     # Copy the whole mesh across for the face.
     # The original mesh in VRoid points that are not used in any face.
@@ -136,22 +139,22 @@ class ExtractMeshes:
             # 0 = inner upper teeth, 1 = outer upper teeth
             new_mesh = MeshMaker(self.stage, material, skeleton, skelJoints)
             self.copy_subset(new_mesh, old_mesh, old_subset, 0, 1)
-            new_mesh.create_at_path(old_mesh.GetPath().GetParentPath().AppendChild('upper_teeth'))
+            self.create_mesh(new_mesh, old_mesh.GetPath().GetParentPath().AppendChild('upper_teeth'))
 
             # 2 = inner lower teeth, 3 = outer lower teeth
             new_mesh = MeshMaker(self.stage, material, skeleton, skelJoints)
             self.copy_subset(new_mesh, old_mesh, old_subset, 2, 3)
-            new_mesh.create_at_path(old_mesh.GetPath().GetParentPath().AppendChild('lower_teeth'))
+            self.create_mesh(new_mesh, old_mesh.GetPath().GetParentPath().AppendChild('lower_teeth'))
             
             # 4 = mouth cavity
             new_mesh = MeshMaker(self.stage, material, skeleton, skelJoints)
             self.copy_subset(new_mesh, old_mesh, old_subset, 4, 4)
-            new_mesh.create_at_path(old_mesh.GetPath().GetParentPath().AppendChild('mouth_cavity'))
+            self.create_mesh(new_mesh, old_mesh.GetPath().GetParentPath().AppendChild('mouth_cavity'))
             
             # 5 = upper tongue, 6 = lower tongue
             new_mesh = MeshMaker(self.stage, material, skeleton, skelJoints)
             self.copy_subset(new_mesh, old_mesh, old_subset, 5, 6)
-            new_mesh.create_at_path(old_mesh.GetPath().GetParentPath().AppendChild('tongue'))
+            self.create_mesh(new_mesh, old_mesh.GetPath().GetParentPath().AppendChild('tongue'))
             
         self.clear_segment_map()
 
@@ -195,7 +198,7 @@ class ExtractMeshes:
             # We use the size of the iris to estimate how far behind the iris the pivot point needs to go.
             pivot_prim_path = old_mesh.GetPath().GetParentPath().AppendChild(eyes[i] + "_pivot")
             xformPrim = UsdGeom.Xform.Define(self.stage, pivot_prim_path)
-            eye_mesh: UsdGeom.Mesh = new_mesh.create_at_path(pivot_prim_path.AppendChild(eyes[i]))
+            eye_mesh: UsdGeom.Mesh = self.create_mesh(new_mesh, pivot_prim_path.AppendChild(eyes[i]))
             extent = eye_mesh.GetExtentAttr().Get()
             (x1,y1,z1) = extent[0]
             (x2,y2,z2) = extent[1]
@@ -212,7 +215,18 @@ class ExtractMeshes:
         skelJoints = UsdSkel.BindingAPI(old_mesh).GetJointsAttr().Get()
         new_mesh = MeshMaker(self.stage, material, skeleton, skelJoints)
         self.copy_subset(new_mesh, old_mesh, old_subset)
-        new_mesh.create_at_path(old_mesh.GetPath().GetParentPath().AppendChild(prim_name))
+        self.create_mesh(new_mesh, old_mesh.GetPath().GetParentPath().AppendChild(prim_name))
+
+    # Create the new Mesh prim at the given path, remembering it so later passes can find the new meshes.
+    # If asked, the triangles and points are reordered first so the GPU vertex cache is used better.
+    def create_mesh(self, new_mesh: MeshMaker, prim_path) -> UsdGeom.Mesh:
+        if self.optimize_vertex_cache:
+            acmr = new_mesh.optimize_vertex_cache()
+            if acmr is not None:
+                print("[ordinary] " + str(prim_path) + " ACMR %.3f -> %.3f" % acmr)
+        mesh = new_mesh.create_at_path(prim_path)
+        self.created_meshes.append(mesh)
+        return mesh
 
     # A GeomSubset holds an array of indicies of which faces are used by this subset.
     # But we need it in a separate Mesh for Audio2Face to be happy.
@@ -220,11 +234,14 @@ class ExtractMeshes:
     # This drops lots of unused points and cleans up the model.
     def copy_subset(self, new_mesh: MeshMaker, old_mesh: UsdGeom.Mesh, old_subset: UsdGeom.Subset, segment1=None, segment2=None):
         faceVertexIndices = old_mesh.GetAttribute('faceVertexIndices').Get()
-        points = old_mesh.GetAttribute('points').Get()     # GetPointsAttr().Get()
-        normals = old_mesh.GetAttribute('normals').Get()   # GetNormalsAttr().Get()
+        points = self.get_static_value(old_mesh, 'points')     # GetPointsAttr().Get()
+        normals = self.get_static_value(old_mesh, 'normals')   # GetNormalsAttr().Get()
         st = old_mesh.GetAttribute('primvars:st').Get()
         jointIndices = old_mesh.GetAttribute('primvars:skel:jointIndices').Get()
         jointWeights = old_mesh.GetAttribute('primvars:skel:jointWeights').Get()
+        if self.read_time_samples(old_mesh, 'points') is not None or self.has_blend_shapes(old_mesh):
+            # Points in the same place at rest (or in the first frame) may move apart later, so keep them separate.
+            new_mesh.merge_by_position = False
         for face_index in old_subset.GetAttribute('indices').Get():  # GetIndicesAttr().Get():
             if self.segment_map is None or self.segment_map[face_index] == segment1 or self.segment_map[face_index] == segment2:
 
@@ -239,7 +256,69 @@ class ExtractMeshes:
                 st1 = st[face_index * 3]
                 st2 = st[face_index * 3 + 1]
                 st3 = st[face_index * 3 + 2]
-                new_mesh.add_face(points, jointIndices, jointWeights, pi1, pi2, pi3, n1, n2, n3, st1, st2, st3)
+                new_mesh.add_face(points, jointIndices, jointWeights, pi1, pi2, pi3, n1, n2, n3, st1, st2, st3, face_index)
+        self.copy_blend_shapes(new_mesh, old_mesh, len(points))
+        self.copy_time_samples(new_mesh, old_mesh)
+
+    # Get the default value of an attribute. Animated meshes may only have time samples, in which case
+    # the first time sample is used.
+    def get_static_value(self, old_mesh: UsdGeom.Mesh, attr_name):
+        attr: Usd.Attribute = old_mesh.GetAttribute(attr_name)
+        value = attr.Get()
+        if value is None:
+            value = attr.Get(Usd.TimeCode.EarliestTime())
+        return value
+
+    # Hand the animated points/normals of the old mesh to the new mesh. The new mesh picks out the values
+    # it needs for all time samples at once when it is created (after any reordering of its points).
+    def copy_time_samples(self, new_mesh: MeshMaker, old_mesh: UsdGeom.Mesh):
+        for (attr_name, element) in TIME_SAMPLED_ATTRIBUTES:
+            samples = self.read_time_samples(old_mesh, attr_name)
+            if samples is not None:
+                (times, values) = samples
+                new_mesh.add_time_samples(attr_name, element, times, values)
+
+    # Read all the time samples of an attribute into one (time, element, 3) array. Returns None if the attribute
+    # is not animated, or the number of values changes over time. The result is cached as every subset
+    # extracted from the old mesh needs the same samples.
+    def read_time_samples(self, old_mesh: UsdGeom.Mesh, attr_name):
+        key = (old_mesh.GetPath(), attr_name)
+        if key not in self.time_samples_cache:
+            samples = None
+            attr: Usd.Attribute = old_mesh.GetAttribute(attr_name)
+            times = attr.GetTimeSamples() if attr else []
+            if len(times) > 0:
+                values = [np.asarray(attr.Get(t), dtype=np.float32).reshape(-1, 3) for t in times]
+                if all(len(v) == len(values[0]) for v in values):
+                    samples = (times, np.stack(values))
+            self.time_samples_cache[key] = samples
+        return self.time_samples_cache[key]
+
+    # Return true if the mesh has any blend shapes bound to it.
+    def has_blend_shapes(self, old_mesh: UsdGeom.Mesh):
+        targets = UsdSkel.BindingAPI(old_mesh).GetBlendShapeTargetsRel().GetTargets()
+        return len(targets) > 0
+
+    # VRoid face meshes have blend shapes for expressions. Copy across the ones that move any
+    # of the points copied into the new mesh. Shapes that do not touch the new mesh are dropped.
+    def copy_blend_shapes(self, new_mesh: MeshMaker, old_mesh: UsdGeom.Mesh, num_old_points):
+        ba: UsdSkel.BindingAPI = UsdSkel.BindingAPI(old_mesh)
+        names = ba.GetBlendShapesAttr().Get()
+        targets = ba.GetBlendShapeTargetsRel().GetTargets()
+        if not names or not targets:
+            return
+        old_to_new = new_mesh.old_to_new_point_indices(num_old_points)
+        for (name, target) in zip(names, targets):
+            shape = UsdSkel.BlendShape(self.stage.GetPrimAtPath(target))
+            if not shape:
+                continue
+            new_mesh.add_blend_shape(
+                name,
+                target.name,
+                old_to_new,
+                shape.GetOffsetsAttr().Get(),
+                shape.GetNormalOffsetsAttr().Get(),
+                shape.GetPointIndicesAttr().Get())
 
     # Clear the segment map.
     def clear_segment_map(self):
@@ -1,4 +1,6 @@
-from pxr import Usd, Sdf, Gf, UsdGeom, UsdShade, UsdSkel
+from pxr import Usd, Sdf, Gf, Vt, UsdGeom, UsdShade, UsdSkel
+import numpy as np
+from . import VertexCache
 
 
 # This class creates a new Mesh by adding faces one at a time.
@@ -17,6 +19,13 @@ class MeshMaker:
         self.skelJoints = skelJoints
         self.skelJointIndices = []
         self.skelJointWeights = []
+        self.point_remap = {}
+        # Points with the same position are merged, unless the points are animated or have blend shapes
+        # (they may move apart later).
+        self.merge_by_position = True
+        self.source_faces = []
+        self.blendShapes = []
+        self.timeSamples = []
 
     # Create a Mesh prim at the given prim path.
     def create_at_path(self, prim_path) -> UsdGeom.Mesh:
@@ -29,7 +38,7 @@ class MeshMaker:
         mesh.SetNormalsInterpolation(UsdGeom.Tokens.faceVarying)
         mesh.CreateFaceVertexCountsAttr(self.faceVertexCounts)
         mesh.CreateFaceVertexIndicesAttr(self.faceVertexIndices)
-        mesh.CreatePrimvar('st', Sdf.ValueTypeNames.TexCoord2fArray, UsdGeom.Tokens.faceVarying).Set(self.st)
+        UsdGeom.PrimvarsAPI(mesh).CreatePrimvar('st', Sdf.ValueTypeNames.TexCoord2fArray, UsdGeom.Tokens.faceVarying).Set(self.st)
         ba: UsdSkel.BindingAPI = UsdSkel.BindingAPI(mesh)
         ba.Apply(mesh.GetPrim())
         ba.CreateGeomBindTransformAttr(Gf.Matrix4d(1,0,0,0, 0,1,0,0, 0,0,1,0, 0,0,0,1))
@@ -38,11 +47,176 @@ class MeshMaker:
         ba.CreateJointIndicesPrimvar(False, elementSize=4).Set(self.skelJointIndices)
         ba.CreateJointWeightsPrimvar(False, elementSize=4).Set(self.skelJointWeights)
         UsdShade.MaterialBindingAPI(mesh).GetDirectBindingRel().SetTargets(self.material)
+        self.create_blend_shapes(mesh, ba)
+        self.create_time_samples(mesh)
         return mesh
+
+    # Remember the animated values of an attribute of the original mesh, to be copied across by create_time_samples().
+    # 'values' is a (time, element, 3) array, where the elements are per 'point' or per face 'corner' of the original mesh.
+    def add_time_samples(self, attr_name, element, times, values):
+        self.timeSamples.append((attr_name, element, times, values))
+
+    # Write the time samples of the animated attributes. Which values of the original mesh are needed is worked
+    # out once, then picked out of all the time samples with one array index operation. The samples are written
+    # straight to the layer inside a change block, so USD only processes the changes once.
+    def create_time_samples(self, mesh: UsdGeom.Mesh):
+        if len(self.timeSamples) == 0:
+            return
+        gathers = {'point': self.new_to_old_point_indices()}
+        if len(self.source_faces) > 0 and None not in self.source_faces:
+            gathers['corner'] = (np.asarray(self.source_faces, dtype=np.int64)[:, None] * 3 + np.arange(3)).reshape(-1)
+        edit_target: Usd.EditTarget = self.stage.GetEditTarget()
+        layer: Sdf.Layer = edit_target.GetLayer()
+        with Sdf.ChangeBlock():
+            for (attr_name, element, times, values) in self.timeSamples:
+                gather = gathers.get(element)
+                if gather is None or len(gather) == 0 or gather.max() >= values.shape[1]:
+                    continue
+                new_values = values[:, gather]
+                attr_path = edit_target.MapToSpecPath(mesh.GetPrim().GetAttribute(attr_name).GetPath())
+                for (time, value) in zip(times, new_values):
+                    layer.SetTimeSample(attr_path, time, Vt.Vec3fArray.FromNumpy(value))
+                if attr_name == 'points':
+                    # The extent has to follow the points around.
+                    extents = np.stack([new_values.min(axis=1), new_values.max(axis=1)], axis=1)
+                    extent_path = edit_target.MapToSpecPath(mesh.GetExtentAttr().GetPath())
+                    for (time, extent) in zip(times, extents):
+                        layer.SetTimeSample(extent_path, time, Vt.Vec3fArray.FromNumpy(extent))
+
+    # Return an array, indexed by the point index in this mesh, of a point index in the original mesh.
+    # Where several original points were merged into one, the first one added is used.
+    def new_to_old_point_indices(self):
+        new_to_old = np.zeros(len(self.points), dtype=np.int64)
+        old_indices = np.fromiter(self.point_remap.keys(), dtype=np.int64, count=len(self.point_remap))
+        new_indices = np.fromiter(self.point_remap.values(), dtype=np.int64, count=len(self.point_remap))
+        (new_indices, first) = np.unique(new_indices, return_index=True)
+        new_to_old[new_indices] = old_indices[first]
+        return new_to_old
+
+    # Reorder the triangles for vertex cache reuse, then the points in the order they are first used.
+    # Everything indexed by face corner (normals, st) or by point (joints, blend shapes) is permuted to match.
+    # Returns the ACMR (average cache miss ratio) before and after, or None if not a triangle mesh.
+    # The Forsyth order can be worse for some meshes, as it models a different cache to the ACMR check,
+    # in which case nothing is changed and the ACMR after is the same as before.
+    def optimize_vertex_cache(self):
+        num_points = len(self.points)
+        if any(count != 3 for count in self.faceVertexCounts):
+            return None
+        triangles = np.asarray(self.faceVertexIndices, dtype=np.int64).reshape(-1, 3)
+        acmr_before = VertexCache.compute_acmr(triangles)
+
+        # Triangle order. Face varying values are stored 3 per triangle, in the same order.
+        triangle_order = VertexCache.forsyth_triangle_order(triangles, num_points)
+        acmr_after = VertexCache.compute_acmr(triangles[triangle_order])
+        if acmr_after >= acmr_before:
+            return (acmr_before, acmr_before)
+        triangles = triangles[triangle_order]
+        corner_order = (triangle_order[:, None] * 3 + np.arange(3)).reshape(-1).tolist()
+        self.normals = [self.normals[i] for i in corner_order]
+        self.st = [self.st[i] for i in corner_order]
+        if len(self.source_faces) == len(triangle_order):
+            self.source_faces = [self.source_faces[i] for i in triangle_order.tolist()]
+
+        # Point order. new_of_old is the inverse permutation, for renumbering indices.
+        point_order = VertexCache.fetch_point_order(triangles, num_points)
+        new_of_old = np.empty(num_points, dtype=np.int64)
+        new_of_old[point_order] = np.arange(num_points)
+        self.faceVertexIndices = new_of_old[triangles].reshape(-1).tolist()
+        self.points = [self.points[i] for i in point_order.tolist()]
+        joint_order = (point_order[:, None] * 4 + np.arange(4)).reshape(-1).tolist()
+        self.skelJointIndices = [self.skelJointIndices[i] for i in joint_order]
+        self.skelJointWeights = [self.skelJointWeights[i] for i in joint_order]
+        self.point_remap = {old: int(new_of_old[new]) for (old, new) in self.point_remap.items()}
+        for (i, (name, prim_name, offsets, normalOffsets, pointIndices)) in enumerate(self.blendShapes):
+            pointIndices = new_of_old[pointIndices]
+            sort = np.argsort(pointIndices)
+            self.blendShapes[i] = (
+                name,
+                prim_name,
+                offsets[sort],
+                None if normalOffsets is None else normalOffsets[sort],
+                pointIndices[sort].astype(np.int32))
+
+        return (acmr_before, acmr_after)
+
+    # Create a BlendShape child prim per kept blend shape and bind them to the mesh.
+    # The skel:blendShapes names are kept from the original mesh so the SkelAnimation still matches them.
+    def create_blend_shapes(self, mesh: UsdGeom.Mesh, ba: UsdSkel.BindingAPI):
+        if len(self.blendShapes) == 0:
+            return
+        names = []
+        targets = []
+        for (name, prim_name, offsets, normalOffsets, pointIndices) in self.blendShapes:
+            shape: UsdSkel.BlendShape = UsdSkel.BlendShape.Define(self.stage, mesh.GetPath().AppendChild(prim_name))
+            shape.CreateOffsetsAttr(Vt.Vec3fArray.FromNumpy(offsets))
+            if normalOffsets is not None:
+                shape.CreateNormalOffsetsAttr(Vt.Vec3fArray.FromNumpy(normalOffsets))
+            shape.CreatePointIndicesAttr(Vt.IntArray.FromNumpy(pointIndices))
+            names.append(name)
+            targets.append(shape.GetPath())
+        ba.CreateBlendShapesAttr(names)
+        ba.CreateBlendShapeTargetsRel().SetTargets(targets)
+
+    # Remap a blend shape of the original mesh onto the points of this mesh. This is done with array
+    # operations on the whole shape at once rather than point by point, as faces have lots of shapes.
+    # The result is always kept in sparse form (offsets + pointIndices), dropping any points that
+    # are not used by this mesh or that the shape does not move. If nothing is left the shape is
+    # dropped completely and False is returned.
+    # old_to_new is from old_to_new_point_indices(), worked out once and shared by all the shapes.
+    def add_blend_shape(self, name, prim_name, old_to_new, offsets, normalOffsets, pointIndices):
+        if offsets is None or len(offsets) == 0 or len(self.point_remap) == 0:
+            return False
+        offsets = np.asarray(offsets, dtype=np.float32).reshape(-1, 3)
+        if normalOffsets is not None and len(normalOffsets) == len(offsets):
+            normalOffsets = np.asarray(normalOffsets, dtype=np.float32).reshape(-1, 3)
+        else:
+            normalOffsets = None
+        if pointIndices is None or len(pointIndices) == 0:
+            # Dense shape, one offset per point of the original mesh.
+            pointIndices = np.arange(len(offsets), dtype=np.int64)
+        else:
+            pointIndices = np.asarray(pointIndices, dtype=np.int64)
+
+        # Look up where each old point ended up (-1 if it is not in this mesh).
+        in_range = (pointIndices >= 0) & (pointIndices < len(old_to_new))
+        new_indices = np.full(len(pointIndices), -1, dtype=np.int64)
+        new_indices[in_range] = old_to_new[pointIndices[in_range]]
+
+        # Keep points in this mesh that actually move.
+        moves = np.any(offsets != 0.0, axis=1)
+        if normalOffsets is not None:
+            moves |= np.any(normalOffsets != 0.0, axis=1)
+        keep = np.flatnonzero((new_indices >= 0) & moves)
+        if len(keep) == 0:
+            return False
+
+        # Each old point has its own new point (merge_by_position is off for meshes with blend shapes),
+        # so just sort the result by new point index.
+        keep = keep[np.argsort(new_indices[keep], kind='stable')]
+        new_indices = new_indices[keep]
+        self.blendShapes.append((
+            name,
+            prim_name,
+            offsets[keep],
+            None if normalOffsets is None else normalOffsets[keep],
+            new_indices.astype(np.int32)))
+        return True
+
+    # Return an array, indexed by the point index in the original mesh, of the point index in this mesh.
+    # Points of the original mesh not used by this mesh are -1.
+    def old_to_new_point_indices(self, num_old_points):
+        old_to_new = np.full(num_old_points, -1, dtype=np.int64)
+        old_indices = np.fromiter(self.point_remap.keys(), dtype=np.int64, count=len(self.point_remap))
+        new_indices = np.fromiter(self.point_remap.values(), dtype=np.int64, count=len(self.point_remap))
+        in_range = old_indices < num_old_points
+        old_to_new[old_indices[in_range]] = new_indices[in_range]
+        return old_to_new
     
     # Add a new face (3 points with normals and mappings to part of the texture)
-    def add_face(self, points, jointIndices, jointWeights, pi1, pi2, pi3, normal1, normal2, normal3, st1, st2, st3):
+    # source_face is the index of the face in the original mesh, used to copy across animated normals.
+    def add_face(self, points, jointIndices, jointWeights, pi1, pi2, pi3, normal1, normal2, normal3, st1, st2, st3, source_face=None):
         self.faceVertexCounts.append(3)
+        self.source_faces.append(source_face)
         self.faceVertexIndices.append(self.new_index_of_point(points, jointIndices, jointWeights, pi1))
         self.faceVertexIndices.append(self.new_index_of_point(points, jointIndices, jointWeights, pi2))
         self.faceVertexIndices.append(self.new_index_of_point(points, jointIndices, jointWeights, pi3))
@@ -56,15 +230,22 @@ class MeshMaker:
     # Given a point, find an existing points array entry and return its index, otherwise add another point
     # and return the index of the new point.
     # If adding a new point, also copy across the skeleton joint index and joint weight from the old point.
+    # The old point index -> new point index is remembered, so blend shapes can be remapped later.
     # TODO: This could be optimized with a lookup table of point->index.
     def new_index_of_point(self, points, jointIndices, jointWeights, point_index):
 
+        if point_index in self.point_remap:
+            return self.point_remap[point_index]
+
         point = points[point_index]
-        for i in range(0, len(self.points)):
-            if self.points[i] == point:
-                return i
+        if self.merge_by_position:
+            for i in range(0, len(self.points)):
+                if self.points[i] == point:
+                    self.point_remap[point_index] = i
+                    return i
 
         self.points.append(point)
+        self.point_remap[point_index] = len(self.points) - 1
 
         # Copy across the old joint information. This assumes element_size = 4.
         self.skelJointIndices.append(jointIndices[point_index * 4])
@@ -0,0 +1,193 @@
+from pxr import Usd, Vt, UsdGeom, UsdSkel
+import numpy as np
+
+# Triangles with less (doubled) area than this are treated as degenerate.
+DEGENERATE_AREA = 1e-12
+
+# How far the joint weights of a point can sum away from 1 before they are renormalized.
+WEIGHT_TOLERANCE = 1e-4
+
+
+# ExtractMeshes trusts the meshes it is given, so bad data either gets copied across silently or
+# causes an exception half way through. This class checks a mesh (and its GeomSubsets) before extraction
+# using array operations over the whole mesh, so it is cheap enough to always run. Problems that can be
+# repaired are fixed in place, and a report (a dict of plain Python values) is returned.
+class ValidateMeshes:
+
+    def __init__(self, stage: Usd.Stage, repair=True):
+        self.stage = stage
+        self.repair = repair
+
+    # Check (and repair if enabled) the mesh. The 'ok' entry of the report is false if the mesh cannot be
+    # extracted, in which case nothing is repaired. If repairing is off, subsets with bad faces also make
+    # the mesh not ok, as the bad faces would reach the extraction.
+    def validate_mesh(self, mesh: UsdGeom.Mesh):
+        report = {
+            'mesh': str(mesh.GetPath()),
+            'ok': True,
+            'errors': [],
+            'num_points': 0,
+            'num_faces': 0,
+            'out_of_range_faces': [],
+            'degenerate_faces': [],
+            'repaired_normals': 0,
+            'repaired_normal_samples': 0,
+            'repaired_st': 0,
+            'repaired_joint_indices': 0,
+            'renormalized_weights': 0,
+            'subsets': {},
+        }
+
+        points = self.get_array(mesh, 'points', np.float64, 3, errors=report['errors'])
+        faceVertexCounts = self.get_array(mesh, 'faceVertexCounts', np.int64, errors=report['errors'])
+        faceVertexIndices = self.get_array(mesh, 'faceVertexIndices', np.int64, errors=report['errors'])
+        num_points = len(points)
+        report['num_points'] = num_points
+        report['num_faces'] = len(faceVertexCounts)
+
+        # The extraction code assumes every face is a triangle with face varying normals and UVs.
+        if len(faceVertexCounts) == 0 or np.any(faceVertexCounts != 3) or len(faceVertexIndices) != 3 * len(faceVertexCounts):
+            report['errors'].append('not a triangle mesh')
+        normals = self.get_array(mesh, 'normals', np.float64, 3, errors=report['errors'])
+        if len(normals) != len(faceVertexIndices):
+            report['errors'].append('normals are not face varying')
+        st = self.get_array(mesh, 'primvars:st', np.float64, 2, errors=report['errors'])
+        if len(st) != len(faceVertexIndices):
+            report['errors'].append('st is not face varying')
+        jointIndices = self.get_array(mesh, 'primvars:skel:jointIndices', np.int64, 4, errors=report['errors'])
+        jointWeights = self.get_array(mesh, 'primvars:skel:jointWeights', np.float64, 4, errors=report['errors'])
+        if len(jointIndices) != num_points or len(jointWeights) != num_points:
+            report['errors'].append('joint indices and weights are not 4 per point')
+        if len(report['errors']) > 0:
+            report['ok'] = False
+            return report
+
+        # Faces that point at points that do not exist, or that have no area.
+        triangles = faceVertexIndices.reshape(-1, 3)
+        out_of_range = np.any((triangles < 0) | (triangles >= num_points), axis=1)
+        corners = points[np.where(out_of_range[:, None], 0, triangles)]
+        cross = np.cross(corners[:, 1] - corners[:, 0], corners[:, 2] - corners[:, 0])
+        area = np.linalg.norm(cross, axis=1)
+        repeated = (triangles[:, 0] == triangles[:, 1]) | (triangles[:, 1] == triangles[:, 2]) | (triangles[:, 0] == triangles[:, 2])
+        degenerate = ~out_of_range & (repeated | ~(area > DEGENERATE_AREA))
+        bad_faces = out_of_range | degenerate
+        report['out_of_range_faces'] = np.flatnonzero(out_of_range).tolist()
+        report['degenerate_faces'] = np.flatnonzero(degenerate).tolist()
+
+        # Normals that are NaN or zero length are replaced with the normal of their face.
+        length = np.linalg.norm(normals, axis=1)
+        bad_normals = ~np.all(np.isfinite(normals), axis=1) | ~(length > 0.0)
+        report['repaired_normals'] = int(np.count_nonzero(bad_normals))
+        if report['repaired_normals'] > 0:
+            normals[bad_normals] = np.repeat(self.face_normals(points, triangles), 3, axis=0)[bad_normals]
+            self.set_array(mesh, 'normals', Vt.Vec3fArray, normals.astype(np.float32))
+
+        # Animated normals are copied across to the new meshes too, so check every time sample.
+        report['repaired_normal_samples'] = self.repair_normal_samples(mesh, triangles)
+
+        # UVs that are NaN are moved to the corner of the texture.
+        bad_st = ~np.all(np.isfinite(st), axis=1)
+        report['repaired_st'] = int(np.count_nonzero(bad_st))
+        if report['repaired_st'] > 0:
+            st[bad_st] = 0.0
+            self.set_array(mesh, 'primvars:st', Vt.Vec2fArray, st.astype(np.float32))
+
+        # Joint indices must be in the joint list. Drop the weight of any that are not.
+        joints = UsdSkel.BindingAPI(mesh).GetJointsAttr().Get()
+        num_joints = len(joints) if joints else 0
+        bad_joint_indices = (jointIndices < 0) | (jointIndices >= num_joints)
+        report['repaired_joint_indices'] = int(np.count_nonzero(bad_joint_indices))
+        if report['repaired_joint_indices'] > 0:
+            jointIndices[bad_joint_indices] = 0
+            jointWeights[bad_joint_indices] = 0.0
+            self.set_array(mesh, 'primvars:skel:jointIndices', Vt.IntArray, jointIndices.reshape(-1).astype(np.int32))
+
+        # Joint weights must be non-negative and add up to one. If there is nothing left, use the first joint.
+        jointWeights[~np.isfinite(jointWeights) | (jointWeights < 0.0)] = 0.0
+        sums = jointWeights.sum(axis=1)
+        unnormalized = ~(np.abs(sums - 1.0) <= WEIGHT_TOLERANCE)
+        report['renormalized_weights'] = int(np.count_nonzero(unnormalized))
+        if report['renormalized_weights'] > 0 or report['repaired_joint_indices'] > 0:
+            no_weight = ~(sums > 0.0)
+            jointWeights[no_weight] = [1.0, 0.0, 0.0, 0.0]
+            sums[no_weight] = 1.0
+            jointWeights /= sums[:, None]
+            self.set_array(mesh, 'primvars:skel:jointWeights', Vt.FloatArray, jointWeights.reshape(-1).astype(np.float32))
+
+        # Drop bad faces from the subsets, which is where the faces to extract come from.
+        for child in mesh.GetChildren():
+            if child.IsA(UsdGeom.Subset):
+                indices = self.get_array(child, 'indices', np.int64)
+                subset_out_of_range = (indices < 0) | (indices >= len(triangles))
+                drop = subset_out_of_range.copy()
+                drop[~subset_out_of_range] = bad_faces[indices[~subset_out_of_range]]
+                report['subsets'][child.GetName()] = {
+                    'out_of_range_indices': int(np.count_nonzero(subset_out_of_range)),
+                    'dropped_faces': int(np.count_nonzero(drop)),
+                }
+                if np.any(drop):
+                    if self.repair:
+                        self.set_array(child, 'indices', Vt.IntArray, indices[~drop].astype(np.int32))
+                    else:
+                        report['ok'] = False
+                        report['errors'].append('subset ' + child.GetName() + ' has bad faces')
+
+        return report
+
+    # Return the unit normal of each triangle. Triangles with no area (or bad points) get (0, 0, 1).
+    def face_normals(self, points, triangles):
+        out_of_range = np.any((triangles < 0) | (triangles >= len(points)), axis=1)
+        corners = points[np.where(out_of_range[:, None], 0, triangles)]
+        cross = np.cross(corners[:, 1] - corners[:, 0], corners[:, 2] - corners[:, 0])
+        area = np.linalg.norm(cross, axis=1)
+        good = ~out_of_range & (area > DEGENERATE_AREA)
+        face_normals = np.tile([0.0, 0.0, 1.0], (len(triangles), 1))
+        face_normals[good] = cross[good] / area[good, None]
+        return face_normals
+
+    # Replace NaN or zero length normals in every time sample of animated normals with the normal of their
+    # face at the same time. All the samples are checked at once. Returns the number of bad normals found.
+    def repair_normal_samples(self, mesh, triangles):
+        normals_attr: Usd.Attribute = mesh.GetAttribute('normals')
+        times = normals_attr.GetTimeSamples()
+        if len(times) == 0:
+            return 0
+        samples = [np.array(normals_attr.Get(t), dtype=np.float64).reshape(-1, 3) for t in times]
+        if any(len(sample) != len(triangles) * 3 for sample in samples):
+            return 0
+        samples = np.stack(samples)
+        bad = ~np.all(np.isfinite(samples), axis=2) | ~(np.linalg.norm(samples, axis=2) > 0.0)
+        count = int(np.count_nonzero(bad))
+        if count == 0 or not self.repair:
+            return count
+        points_attr: Usd.Attribute = mesh.GetAttribute('points')
+        for i in np.flatnonzero(np.any(bad, axis=1)).tolist():
+            points = np.array(points_attr.Get(times[i]), dtype=np.float64).reshape(-1, 3)
+            samples[i][bad[i]] = np.repeat(self.face_normals(points, triangles), 3, axis=0)[bad[i]]
+            normals_attr.Set(Vt.Vec3fArray.FromNumpy(samples[i].astype(np.float32)), times[i])
+        return count
+
+    # Read an attribute as a numpy array (an empty one if not set), with the given number of values per element.
+    # If there is no default value (e.g. animated points), the first time sample is checked instead.
+    # If the number of values is not a multiple of the element size, an error is added to 'errors' (if given)
+    # and an empty array is returned.
+    def get_array(self, prim, attr_name, dtype, element_size=1, errors=None):
+        attr: Usd.Attribute = prim.GetAttribute(attr_name)
+        value = attr.Get()
+        if value is None:
+            value = attr.Get(Usd.TimeCode.EarliestTime())
+        if value is None:
+            value = []
+        array = np.array(value, dtype=dtype)
+        if element_size > 1:
+            if array.ndim == 1 and len(array) % element_size != 0:
+                if errors is not None:
+                    errors.append(attr_name + ' is not a multiple of ' + str(element_size) + ' values')
+                array = np.empty(0, dtype=dtype)
+            array = array.reshape(-1, element_size)
+        return array
+
+    # Write a numpy array back to an attribute, if repairing is turned on.
+    def set_array(self, prim, attr_name, vt_type, array):
+        if self.repair:
+            prim.GetAttribute(attr_name).Set(vt_type.FromNumpy(array))
@@ -0,0 +1,122 @@
+import numpy as np
+
+# Reorder triangles and points so the GPU post-transform vertex cache gets reused, and points are
+# fetched from memory in the order they are first used.
+# The triangle order uses Tom Forsyth's "Linear-Speed Vertex Cache Optimisation" algorithm
+# (https://tomforsyth1000.github.io/papers/fast_vert_cache_opt.html).
+
+FORSYTH_CACHE_SIZE = 32
+FORSYTH_CACHE_DECAY_POWER = 1.5
+FORSYTH_LAST_TRI_SCORE = 0.75
+FORSYTH_VALENCE_BOOST_SCALE = 2.0
+FORSYTH_VALENCE_BOOST_POWER = 0.5
+
+# Size of the FIFO cache simulated when working out the ACMR (average cache miss ratio).
+ACMR_CACHE_SIZE = 16
+
+
+# The Forsyth score of a vertex based on where it is in the cache and how many triangles still use it.
+def vertex_score(cache_position, remaining_valence):
+    if remaining_valence == 0:
+        return -1.0
+    score = 0.0
+    if cache_position >= 0:
+        if cache_position < 3:
+            # The last triangle added - we don't want to use these again straight away.
+            score = FORSYTH_LAST_TRI_SCORE
+        else:
+            scaler = 1.0 / (FORSYTH_CACHE_SIZE - 3)
+            score = (1.0 - (cache_position - 3) * scaler) ** FORSYTH_CACHE_DECAY_POWER
+    # Bonus for vertices with few triangles left, so we finish off areas rather than leave lone triangles.
+    score += FORSYTH_VALENCE_BOOST_SCALE * (remaining_valence ** -FORSYTH_VALENCE_BOOST_POWER)
+    return score
+
+
+# Return the order to draw the triangles in (an array of the old triangle numbers).
+# 'triangles' is an (n, 3) array of point indices.
+def forsyth_triangle_order(triangles, num_points):
+    num_triangles = len(triangles)
+    tris = triangles.tolist()
+
+    # Which triangles use each point.
+    point_triangles = [[] for _ in range(num_points)]
+    for t, (a, b, c) in enumerate(tris):
+        point_triangles[a].append(t)
+        point_triangles[b].append(t)
+        point_triangles[c].append(t)
+
+    cache_position = [-1] * num_points
+    remaining = [len(pt) for pt in point_triangles]
+    scores = [vertex_score(-1, r) for r in remaining]
+    added = [False] * num_triangles
+
+    order = []
+    cache = []
+    next_unadded = 0
+    best = -1
+    while len(order) < num_triangles:
+
+        # If the cache did not give us a triangle, take the next one not done yet in the input order.
+        if best < 0:
+            while added[next_unadded]:
+                next_unadded += 1
+            best = next_unadded
+
+        added[best] = True
+        order.append(best)
+        for p in tris[best]:
+            remaining[p] -= 1
+            point_triangles[p].remove(best)
+            if p in cache:
+                cache.remove(p)
+            cache.insert(0, p)
+
+        # Points that drop off the end of the cache are no longer in the cache.
+        for p in cache[FORSYTH_CACHE_SIZE:]:
+            cache_position[p] = -1
+            scores[p] = vertex_score(-1, remaining[p])
+        del cache[FORSYTH_CACHE_SIZE:]
+
+        # Update the scores of the points in the cache and their triangles, and pick the best one.
+        for i, p in enumerate(cache):
+            cache_position[p] = i
+            scores[p] = vertex_score(i, remaining[p])
+        best = -1
+        best_score = -1.0
+        for p in cache:
+            for t in point_triangles[p]:
+                (a, b, c) = tris[t]
+                score = scores[a] + scores[b] + scores[c]
+                if score > best_score:
+                    best_score = score
+                    best = t
+
+    return np.array(order, dtype=np.int64)
+
+
+# Given triangles (already in draw order), return an array of the old point number for each new point,
+# in the order points are first used. Points not used by any triangle are kept at the end.
+def fetch_point_order(triangles, num_points):
+    flat = triangles.reshape(-1)
+    (used, first_use) = np.unique(flat, return_index=True)
+    used_in_order = used[np.argsort(first_use)]
+    unused = np.setdiff1d(np.arange(num_points), used, assume_unique=True)
+    return np.concatenate([used_in_order, unused]).astype(np.int64)
+
+
+# Average number of cache misses per triangle for a simulated FIFO vertex cache.
+# 0.5 is about the best possible for a large regular mesh, 3.0 is the worst.
+def compute_acmr(triangles, cache_size=ACMR_CACHE_SIZE):
+    if len(triangles) == 0:
+        return 0.0
+    cache = []
+    in_cache = set()
+    misses = 0
+    for p in triangles.reshape(-1).tolist():
+        if p not in in_cache:
+            misses += 1
+            cache.append(p)
+            in_cache.add(p)
+            if len(cache) > cache_size:
+                in_cache.discard(cache.pop(0))
+    return misses / len(triangles)
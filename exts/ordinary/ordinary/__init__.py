@@ -1 +1,6 @@
-from .extension import *
+# The USD processing modules (CleanUp, ExtractMeshes, etc) only need pxr, so can also be used outside Kit.
+try:
+    from .extension import *
+except ModuleNotFoundError as e:
+    if not e.name.startswith('omni'):
+        raise
@@ -6,7 +6,7 @@ import omni.ext
 import omni.ui as ui
 import omni.kit.commands
 from pxr import Usd, Sdf, Gf, UsdGeom
-from .ExtractMeshes import ExtractMeshes
+from .CleanUp import CleanUp
 
 
 # Functions and vars are available to other extension as usual in python: `example.python_ext.some_public_function(x)`
@@ -29,6 +29,8 @@ class OrdinaryExtension(omni.ext.IExt):
             # TODO: Clean up the UI... one day.
             with ui.VStack():
                 label = ui.Label("")
+                self._crop_textures_model = ui.SimpleBoolModel(False)
+                self._optimize_vertex_cache_model = ui.SimpleBoolModel(False)
 
                 def on_click():
                     self.clean_up_prim()
@@ -41,6 +43,14 @@ class OrdinaryExtension(omni.ext.IExt):
 
                 label.text = "dump"
 
+                with ui.HStack():
+                    ui.CheckBox(model=self._crop_textures_model, width=20)
+                    ui.Label("Crop textures")
+
+                with ui.HStack():
+                    ui.CheckBox(model=self._optimize_vertex_cache_model, width=20)
+                    ui.Label("Optimize vertex cache")
+
                 with ui.HStack():
                     ui.Button("Clean", clicked_fn=on_click)
                     ui.Button("Dump", clicked_fn=on_dump)
@@ -48,59 +58,12 @@ class OrdinaryExtension(omni.ext.IExt):
     def on_shutdown(self):
         print("[ordinary] ordinary shutdown")
 
-    # The main body of the clean up code for VRoid Studio characters.
+    # Run the clean up on the currently open stage.
     def clean_up_prim(self):
-
-        # VRoid Studio dependent code. This code has hard coded path names used by VRoid Studio characters.
-        # If needed, could clean this up to make more generic.
-        # But I am also hoping NVIDIA fix their GLB import code, so trying to minimize my effort.
-
-        # The problem is the bone structure is it picks one level too deep for the bone hierarchy.
-        # /World/Root/J_Bip_C_Hips0/Skeleton/J_Bip_C_Hips/... should have been one node higher, so Root was
-        # included under Skeleton. Without this, it thinks the Hips are the root bone (at height zero).
-        # To work around the problem, I go through all the joint lists and insert "Root/" at the start
-        # of the joint paths.
-
         ctx = omni.usd.get_context()
         stage = ctx.get_stage()
+        KitCleanUp(stage, self._crop_textures_model.as_bool, self._optimize_vertex_cache_model.as_bool).clean_up()
 
-        # TODO: May have a go at this again, moving everything up so its Root/Skeleton without the hips.
-        # root_prim = stage.GetPrimAtPath('/World/Root')
-        # root_prim.SetTypeName('SkelRoot')
-
-        # Move Skeleton directly under Root layer
-        # self.move_if_necessary(stage, '/World/Root/J_Bip_C_Hips0/Skeleton', '/World/Root/Skeleton')
-
-        # Move meshes directly under Root layer, next to Skeleton
-        # self.move_if_necessary(stage, '/World/Root/J_Bip_C_Hips0/Face_baked', '/World/Root/Face_baked')
-        # self.move_if_necessary(stage, '/World/Root/J_Bip_C_Hips0/Body_baked', '/World/Root/Body_baked')
-        # self.move_if_necessary(stage, '/World/Root/J_Bip_C_Hips0/Hair001_baked', '/World/Root/Hair001_baked')
-
-        # Patch the skeleton structure, if not done already. Add "Root" to the joint list.
-        skeleton_prim = stage.GetPrimAtPath('/World/Root/J_Bip_C_Hips0/Skeleton')
-        if skeleton_prim:
-            self.add_parent_to_skeleton_joint_list(skeleton_prim, 'Root')
-
-        for child in stage.GetPrimAtPath('/World/Root/J_Bip_C_Hips0').GetChildren():
-            if child.IsA(UsdGeom.Mesh):
-                self.add_parent_to_mesh_joint_list(child, 'Root')
-                # self.split_disconnected_meshes(stage, child)
-                if child.GetName().startswith("Face_"):
-                    e = ExtractMeshes(stage)
-                    e.extract_face_meshes(child)
-                if child.GetName().startswith("Hair"):
-                    e = ExtractMeshes(stage)
-                    e.extract_hair_meshes(child)
-                if child.GetName().startswith("Body_"):
-                    e = ExtractMeshes(stage)
-                    e.extract_body_meshes(child)
-
-        # Delete the dangling node (was old SkelRoot)
-        # self.delete_if_no_children(stage, '/World/Root/J_Bip_C_Hips0')
-
-        # Delete old skeleton if present.
-        if stage.GetPrimAtPath('/World/Root/J_Bip_C_Hips0/Skeleton/J_Bip_C_Hips'):
-            omni.kit.commands.execute('DeletePrims', paths=[Sdf.Path('/World/Root/J_Bip_C_Hips0/Skeleton/J_Bip_C_Hips')])
 
     # If a prim exists at the source path, move it to the target path.
     # Returns true if moved, false otherwise.
@@ -128,52 +91,6 @@ class OrdinaryExtension(omni.ext.IExt):
                 return True
         return False
 
-    def add_parent_to_skeleton_joint_list(self, skeleton_prim: Usd.Prim, parent_name):
-        """
-        A skeleton has 3 attributes:
-        - uniform matrix4d[] bindTransforms = [( (1, 0, -0, 0), ...]
-        - uniform token[] joints = ["J_Bip_C_Hips", ...]
-        - uniform matrix4d[] restTransforms = [( (1, 0, -0, 0), ...]
-
-        In Omniverse Code etc, you can hover over the names in the "Raw USD Property" panel to get
-        more documentation on the above properties.
-
-        We need to insert the new parent at the front of the three lists, and prepend the name to the join paths.
-        """
-
-        # Get the attributes
-        joints: Usd.Attribute = skeleton_prim.GetAttribute('joints')
-        bindTransforms: Usd.Attribute = skeleton_prim.GetAttribute('bindTransforms')
-        restTransforms: Usd.Attribute = skeleton_prim.GetAttribute('restTransforms')
-
-        # If first join is the parent name already, nothing to do.
-        if joints.Get()[0] == parent_name:
-            return False
-
-        # TODO: I use raw USD functions here, but there is also omni.kit.commands.execute("ChangeProperty",...)
-        # if want undo...
-        # https://docs.omniverse.nvidia.com/prod_kit/prod_kit/programmer_ref/usd/properties/set-attribute.html#omniverse-kit-commands
-        joints.Set([parent_name] + [parent_name + '/' + jp for jp in joints.Get()])
-
-        # Insert unity matrix at the start for the root node we added.
-        # ((1, 0, 0, 0), (0, 1, 0, 0), (0, 0, 1, 0), (0, 0, 0, 1))
-        unity_matrix = Gf.Matrix4d(1, 0, 0, 0, 0, 1, 0, 0, 0, 0, 1, 0, 0, 0, 0, 1)
-        if bindTransforms.IsValid():
-            bindTransforms.Set([unity_matrix] + [x for x in bindTransforms.Get()])
-        if restTransforms.IsValid():
-            restTransforms.Set([unity_matrix] + [x for x in restTransforms.Get()])
-
-    # The meshes have paths to bones as well - add "Root" to their paths as well.
-    def add_parent_to_mesh_joint_list(self, mesh_prim, parent_name):
-        if mesh_prim:
-            joints: Usd.Attribute = mesh_prim.GetAttribute('skel:joints')
-
-            # Don't touch empty string. Don't add if already added. First value might be empty string.
-            if not joints.Get()[1].startswith(parent_name):
-                joints.Set([jp if jp == "" else parent_name + '/' + jp for jp in joints.Get()])
-                return True
-        return False
-
     # Going to delete this - ended up creating a separate class for this. It got tricky.
     #def split_disconnected_meshes(self, stage: Usd.Stage, mesh_prim: UsdGeom.Mesh):
     #    """
@@ -221,3 +138,10 @@ class OrdinaryExtension(omni.ext.IExt):
                         print(attr.GetPath(), len(attr.Get()))
                 except Exception:
                     pass
+
+
+# The clean up, but deleting prims using Kit commands.
+class KitCleanUp(CleanUp):
+
+    def delete_prim(self, path: Sdf.Path):
+        omni.kit.commands.execute('DeletePrims', paths=[path])
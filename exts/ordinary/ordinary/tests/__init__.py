@@ -1 +1,5 @@
-from .test_hello_world import *
\ No newline at end of file
+from .test_hello_world import *
+from .test_vertex_cache import *
+from .test_blend_shapes import *
+from .test_validate_meshes import *
+from .test_time_samples import *
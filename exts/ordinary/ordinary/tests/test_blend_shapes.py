@@ -0,0 +1,80 @@
+# Tests of copying blend shapes across to the extracted meshes.
+import omni.kit.test
+from pxr import Usd, Sdf, UsdGeom, UsdSkel
+
+from ordinary.MeshMaker import MeshMaker
+from ordinary.ExtractMeshes import ExtractMeshes
+
+
+# Build a MeshMaker from a list of triangles.
+def make_mesh_maker(points, triangles):
+    jointIndices = [0] * (len(points) * 4)
+    jointWeights = [1.0, 0.0, 0.0, 0.0] * len(points)
+    mesh = MeshMaker(None, None, None, None)
+    for (face, (p1, p2, p3)) in enumerate(triangles):
+        mesh.add_face(points, jointIndices, jointWeights, p1, p2, p3, None, None, None, None, None, None, face)
+    return mesh
+
+
+# Make a stage with a face mesh of an upper and lower lip triangle. Point 0 of the upper lip is in the same
+# place as point 3 of the lower lip, and the "jawOpen" blend shape only moves the lower lip.
+def make_lips_stage():
+    stage = Usd.Stage.CreateInMemory()
+    mesh = UsdGeom.Mesh.Define(stage, '/Root/Face_baked')
+    mesh.CreatePointsAttr([(0, 0, 0), (1, 0, 0), (0, 1, 0), (0, 0, 0), (1, 0, 0), (0, -1, 0)])
+    mesh.CreateFaceVertexCountsAttr([3, 3])
+    mesh.CreateFaceVertexIndicesAttr([0, 1, 2, 3, 4, 5])
+    mesh.CreateNormalsAttr([(0, 0, 1)] * 6)
+    UsdGeom.PrimvarsAPI(mesh).CreatePrimvar('st', Sdf.ValueTypeNames.TexCoord2fArray, UsdGeom.Tokens.faceVarying).Set([(0, 0)] * 6)
+    ba = UsdSkel.BindingAPI.Apply(mesh.GetPrim())
+    ba.CreateJointsAttr(['Root'])
+    ba.CreateJointIndicesPrimvar(False, elementSize=4).Set([0] * 24)
+    ba.CreateJointWeightsPrimvar(False, elementSize=4).Set([1.0, 0.0, 0.0, 0.0] * 6)
+    subset = UsdGeom.Subset.Define(stage, '/Root/Face_baked/F00_000_00_Face_00_SKIN')
+    subset.CreateElementTypeAttr(UsdGeom.Tokens.face)
+    subset.CreateIndicesAttr([0, 1])
+    shape = UsdSkel.BlendShape.Define(stage, '/Root/Face_baked/jawOpen')
+    shape.CreateOffsetsAttr([(0, -1, 0)] * 3)
+    shape.CreatePointIndicesAttr([3, 4, 5])
+    ba.CreateBlendShapesAttr(['jawOpen'])
+    ba.CreateBlendShapeTargetsRel().SetTargets([shape.GetPath()])
+    return (stage, mesh.GetPrim(), subset.GetPrim())
+
+
+class TestBlendShapes(omni.kit.test.AsyncTestCase):
+
+    async def test_unused_points_and_shapes_dropped(self):
+        points = [(0.0, 0.0, 0.0), (1.0, 0.0, 0.0), (0.0, 1.0, 0.0), (5.0, 5.0, 5.0)]
+        mesh = make_mesh_maker(points, [(0, 1, 2)])
+        old_to_new = mesh.old_to_new_point_indices(len(points))
+
+        # Point 3 is not in the mesh and point 1 does not move.
+        self.assertTrue(mesh.add_blend_shape('a', 'a', old_to_new, [(1, 0, 0), (0, 0, 0), (2, 0, 0), (3, 0, 0)], None, None))
+        # Only moves a point not in the mesh.
+        self.assertFalse(mesh.add_blend_shape('b', 'b', old_to_new, [(1, 1, 1)], None, [3]))
+
+        self.assertEqual(len(mesh.blendShapes), 1)
+        (name, _, offsets, normalOffsets, pointIndices) = mesh.blendShapes[0]
+        self.assertEqual(name, 'a')
+        self.assertIsNone(normalOffsets)
+        self.assertEqual(pointIndices.tolist(), [0, 2])
+        self.assertEqual(offsets.tolist(), [[1, 0, 0], [2, 0, 0]])
+
+    async def test_old_to_new_point_indices(self):
+        # Points 0 and 3 are in the same place, so are merged.
+        points = [(0.0, 0.0, 0.0), (1.0, 0.0, 0.0), (0.0, 1.0, 0.0), (0.0, 0.0, 0.0), (5.0, 5.0, 5.0)]
+        mesh = make_mesh_maker(points, [(0, 1, 2), (3, 2, 1)])
+        self.assertEqual(mesh.old_to_new_point_indices(len(points)).tolist(), [0, 1, 2, 0, -1])
+        self.assertEqual(mesh.new_to_old_point_indices().tolist(), [0, 1, 2])
+
+    async def test_points_with_blend_shapes_not_merged(self):
+        (stage, mesh, subset) = make_lips_stage()
+        new_mesh = MeshMaker(stage, [], [], ['Root'])
+        ExtractMeshes(stage).copy_subset(new_mesh, mesh, subset)
+
+        # The lips keep separate points, so opening the jaw only moves the lower lip.
+        self.assertEqual(len(new_mesh.points), 6)
+        (name, _, offsets, _, pointIndices) = new_mesh.blendShapes[0]
+        self.assertEqual(name, 'jawOpen')
+        self.assertEqual(pointIndices.tolist(), [3, 4, 5])
+        self.assertEqual(offsets.tolist(), [[0, -1, 0]] * 3)
@@ -0,0 +1,83 @@
+# Tests of copying animated (time sampled) points and normals across to the extracted meshes.
+import random
+import numpy as np
+import omni.kit.test
+from pxr import Usd, Sdf, UsdGeom, UsdSkel
+
+from ordinary.MeshMaker import MeshMaker
+from ordinary.ExtractMeshes import ExtractMeshes
+
+TIMES = [1.0, 2.0, 3.0]
+
+
+# Make a stage with an animated grid mesh (triangles in a random order) in one subset.
+# Each point moves differently over time, and each corner's normal records its face and corner.
+def make_animated_stage(size):
+    stage = Usd.Stage.CreateInMemory()
+    points = np.array([(x, y, 0.0) for y in range(size) for x in range(size)], dtype=np.float32)
+    triangles = []
+    for y in range(size - 1):
+        for x in range(size - 1):
+            a = y * size + x
+            triangles.append((a, a + 1, a + size))
+            triangles.append((a + 1, a + size + 1, a + size))
+    random.Random(1).shuffle(triangles)
+
+    mesh = UsdGeom.Mesh.Define(stage, '/Root/Face_baked')
+    mesh.CreateFaceVertexCountsAttr([3] * len(triangles))
+    mesh.CreateFaceVertexIndicesAttr([p for triangle in triangles for p in triangle])
+    points_attr = mesh.CreatePointsAttr()
+    normals_attr = mesh.CreateNormalsAttr()
+    for t in TIMES:
+        points_attr.Set([tuple(p) for p in points * t + np.arange(len(points))[:, None] * t], t)
+        normals_attr.Set([(f, c, t) for f in range(len(triangles)) for c in range(3)], t)
+    UsdGeom.PrimvarsAPI(mesh).CreatePrimvar('st', Sdf.ValueTypeNames.TexCoord2fArray, UsdGeom.Tokens.faceVarying).Set([(0, 0)] * (len(triangles) * 3))
+    ba = UsdSkel.BindingAPI.Apply(mesh.GetPrim())
+    ba.CreateJointsAttr(['Root'])
+    ba.CreateJointIndicesPrimvar(False, elementSize=4).Set([0] * (len(points) * 4))
+    ba.CreateJointWeightsPrimvar(False, elementSize=4).Set([1.0, 0.0, 0.0, 0.0] * len(points))
+    subset = UsdGeom.Subset.Define(stage, '/Root/Face_baked/F00_000_00_Face_00_SKIN')
+    subset.CreateElementTypeAttr(UsdGeom.Tokens.face)
+    subset.CreateIndicesAttr(list(range(len(triangles))))
+    return (stage, mesh.GetPrim(), subset.GetPrim())
+
+
+class TestTimeSamples(omni.kit.test.AsyncTestCase):
+
+    async def test_time_samples_gathered_through_remap(self):
+        (stage, old_mesh, subset) = make_animated_stage(8)
+        ExtractMeshes(stage, optimize_vertex_cache=True).make_mesh_from_subset(old_mesh, subset, 'face_skin')
+        new_mesh = stage.GetPrimAtPath('/Root/face_skin')
+
+        old_points = old_mesh.GetAttribute('points')
+        old_normals = old_mesh.GetAttribute('normals')
+        new_points = new_mesh.GetAttribute('points')
+        new_normals = new_mesh.GetAttribute('normals')
+        new_extent = new_mesh.GetAttribute('extent')
+        self.assertEqual(new_points.GetTimeSamples(), TIMES)
+        self.assertEqual(new_normals.GetTimeSamples(), TIMES)
+        self.assertEqual(new_extent.GetTimeSamples(), TIMES)
+
+        # Work out which old point and corner each new one came from using the first frame
+        # (every point and normal is different), then check every frame picks the same ones.
+        first_points = np.asarray(old_points.Get(TIMES[0]))
+        point_lookup = {tuple(p): i for (i, p) in enumerate(first_points.tolist())}
+        point_gather = [point_lookup[tuple(p)] for p in np.asarray(new_points.Get()).tolist()]
+        corner_gather = [int(f) * 3 + int(c) for (f, c, _) in np.asarray(new_normals.Get()).tolist()]
+        # The triangles were reordered, not left as they were.
+        self.assertNotEqual(corner_gather, list(range(len(corner_gather))))
+        for t in TIMES:
+            points = np.asarray(new_points.Get(t))
+            self.assertTrue(np.array_equal(points, np.asarray(old_points.Get(t))[point_gather]))
+            self.assertTrue(np.array_equal(np.asarray(new_normals.Get(t)), np.asarray(old_normals.Get(t))[corner_gather]))
+            extent = np.asarray(new_extent.Get(t))
+            self.assertTrue(np.array_equal(extent, np.stack([points.min(axis=0), points.max(axis=0)])))
+
+    async def test_no_merge_by_position(self):
+        points = [(0.0, 0.0, 0.0), (1.0, 0.0, 0.0), (0.0, 1.0, 0.0), (0.0, 0.0, 0.0)]
+        mesh = MeshMaker(None, None, None, None)
+        mesh.merge_by_position = False
+        jointIndices = [0] * 16
+        for (p1, p2, p3) in [(0, 1, 2), (3, 2, 1)]:
+            mesh.add_face(points, jointIndices, jointIndices, p1, p2, p3, None, None, None, None, None, None)
+        self.assertEqual(mesh.old_to_new_point_indices(len(points)).tolist(), [0, 1, 2, 3])
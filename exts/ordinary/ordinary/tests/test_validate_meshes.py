@@ -0,0 +1,86 @@
+# Tests of checking and repairing meshes before extraction.
+import math
+import omni.kit.test
+from pxr import Usd, Sdf, UsdGeom, UsdSkel
+
+from ordinary.ValidateMeshes import ValidateMeshes
+
+
+# Make a stage with a mesh of 4 triangles in one subset: two good ones, one pointing at a point that does not
+# exist, and one with no area.
+def make_mesh_stage():
+    stage = Usd.Stage.CreateInMemory()
+    mesh = UsdGeom.Mesh.Define(stage, '/Root/Body_baked')
+    mesh.CreatePointsAttr([(0, 0, 0), (1, 0, 0), (0, 1, 0), (1, 1, 0)])
+    mesh.CreateFaceVertexCountsAttr([3, 3, 3, 3])
+    mesh.CreateFaceVertexIndicesAttr([0, 1, 2, 1, 3, 2, 0, 1, 9, 0, 0, 1])
+    mesh.CreateNormalsAttr([(0, 0, 1)] * 12)
+    UsdGeom.PrimvarsAPI(mesh).CreatePrimvar('st', Sdf.ValueTypeNames.TexCoord2fArray, UsdGeom.Tokens.faceVarying).Set([(0, 0)] * 12)
+    ba = UsdSkel.BindingAPI.Apply(mesh.GetPrim())
+    ba.CreateJointsAttr(['Root', 'Root/Hips'])
+    ba.CreateJointIndicesPrimvar(False, elementSize=4).Set([0, 1, 0, 0] * 4)
+    ba.CreateJointWeightsPrimvar(False, elementSize=4).Set([0.5, 0.5, 0.0, 0.0] * 4)
+    subset = UsdGeom.Subset.Define(stage, '/Root/Body_baked/F00_000_00_Body_00_SKIN')
+    subset.CreateElementTypeAttr(UsdGeom.Tokens.face)
+    subset.CreateIndicesAttr([0, 1, 2, 3])
+    return (stage, mesh.GetPrim(), subset.GetPrim())
+
+
+class TestValidateMeshes(omni.kit.test.AsyncTestCase):
+
+    async def test_bad_faces_dropped_from_subset(self):
+        (stage, mesh, subset) = make_mesh_stage()
+        report = ValidateMeshes(stage).validate_mesh(mesh)
+        self.assertTrue(report['ok'])
+        self.assertEqual(report['out_of_range_faces'], [2])
+        self.assertEqual(report['degenerate_faces'], [3])
+        self.assertEqual(report['subsets']['F00_000_00_Body_00_SKIN']['dropped_faces'], 2)
+        self.assertEqual(list(subset.GetAttribute('indices').Get()), [0, 1])
+
+    async def test_bad_faces_not_ok_without_repair(self):
+        (stage, mesh, subset) = make_mesh_stage()
+        report = ValidateMeshes(stage, repair=False).validate_mesh(mesh)
+        self.assertFalse(report['ok'])
+        self.assertEqual(list(subset.GetAttribute('indices').Get()), [0, 1, 2, 3])
+
+    async def test_nan_normal_repaired(self):
+        (stage, mesh, subset) = make_mesh_stage()
+        normals = mesh.GetAttribute('normals')
+        normals.Set([(math.nan, 0, 0), (0, 0, 0)] + [(0, 0, 1)] * 10)
+        report = ValidateMeshes(stage).validate_mesh(mesh)
+        self.assertEqual(report['repaired_normals'], 2)
+        # Replaced with the normal of the first face.
+        self.assertEqual([tuple(n) for n in normals.Get()[:2]], [(0, 0, 1), (0, 0, 1)])
+
+    async def test_nan_normal_in_time_sample_repaired(self):
+        (stage, mesh, subset) = make_mesh_stage()
+        normals = mesh.GetAttribute('normals')
+        normals.Set([(0, 0, 1)] * 12, 1.0)
+        normals.Set([(math.nan, 0, 0)] + [(0, 0, 1)] * 11, 2.0)
+        report = ValidateMeshes(stage).validate_mesh(mesh)
+        self.assertEqual(report['repaired_normal_samples'], 1)
+        self.assertEqual(tuple(normals.Get(2.0)[0]), (0, 0, 1))
+
+    async def test_bad_joint_index_cleared(self):
+        (stage, mesh, subset) = make_mesh_stage()
+        mesh.GetAttribute('primvars:skel:jointIndices').Set([5, 1, 0, 0] + [0, 1, 0, 0] * 3)
+        report = ValidateMeshes(stage).validate_mesh(mesh)
+        self.assertEqual(report['repaired_joint_indices'], 1)
+        self.assertEqual(list(mesh.GetAttribute('primvars:skel:jointIndices').Get()[:4]), [0, 1, 0, 0])
+        # The weight of the bad joint is dropped, leaving all the weight on the other joint.
+        self.assertEqual(list(mesh.GetAttribute('primvars:skel:jointWeights').Get()[:4]), [0.0, 1.0, 0.0, 0.0])
+
+    async def test_weights_renormalized(self):
+        (stage, mesh, subset) = make_mesh_stage()
+        mesh.GetAttribute('primvars:skel:jointWeights').Set([2.0, 2.0, 0.0, 0.0] + [0.5, 0.5, 0.0, 0.0] * 3)
+        report = ValidateMeshes(stage).validate_mesh(mesh)
+        self.assertEqual(report['renormalized_weights'], 1)
+        self.assertEqual(list(mesh.GetAttribute('primvars:skel:jointWeights').Get()[:4]), [0.5, 0.5, 0.0, 0.0])
+
+    async def test_wrong_size_array_reported(self):
+        (stage, mesh, subset) = make_mesh_stage()
+        mesh.GetAttribute('primvars:skel:jointWeights').Set([1.0, 0.0, 0.0, 0.0, 1.0, 0.0])
+        report = ValidateMeshes(stage).validate_mesh(mesh)
+        self.assertFalse(report['ok'])
+        self.assertIn('primvars:skel:jointWeights is not a multiple of 4 values', report['errors'])
+        self.assertEqual(list(subset.GetAttribute('indices').Get()), [0, 1, 2, 3])
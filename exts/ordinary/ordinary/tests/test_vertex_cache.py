@@ -0,0 +1,101 @@
+# Tests of the vertex cache reordering of meshes.
+# These only work on the arrays MeshMaker builds up, so no stage is needed.
+import random
+import numpy as np
+import omni.kit.test
+
+from ordinary import VertexCache
+from ordinary.MeshMaker import MeshMaker
+
+
+# Make a grid of points and triangles, with the triangles in row order.
+def make_grid(size):
+    points = [(float(x), float(y), 0.0) for y in range(size) for x in range(size)]
+    triangles = []
+    for y in range(size - 1):
+        for x in range(size - 1):
+            a = y * size + x
+            triangles.append((a, a + 1, a + size))
+            triangles.append((a + 1, a + size + 1, a + size))
+    return (points, triangles)
+
+
+# Make a grid of points and triangles, with the triangles in a random order.
+def make_shuffled_grid(size):
+    (points, triangles) = make_grid(size)
+    random.Random(1).shuffle(triangles)
+    return (points, triangles)
+
+
+# Build a MeshMaker from the grid. Each corner's normal and st record the face and corner they came from,
+# and each point's joint indices record the point it came from, so they can be checked after reordering.
+def make_mesh_maker(points, triangles):
+    jointIndices = [i // 4 for i in range(len(points) * 4)]
+    jointWeights = [0.25] * (len(points) * 4)
+    mesh = MeshMaker(None, None, None, None)
+    for (face, (p1, p2, p3)) in enumerate(triangles):
+        mesh.add_face(points, jointIndices, jointWeights, p1, p2, p3,
+                      (face, 0, 0), (face, 1, 0), (face, 2, 0),
+                      (face, 0), (face, 1), (face, 2), face)
+    return mesh
+
+
+class TestVertexCache(omni.kit.test.AsyncTestCase):
+
+    async def test_triangle_order_is_permutation(self):
+        (points, triangles) = make_shuffled_grid(20)
+        order = VertexCache.forsyth_triangle_order(np.array(triangles), len(points))
+        self.assertEqual(sorted(order.tolist()), list(range(len(triangles))))
+
+    async def test_point_order_is_first_use(self):
+        triangles = np.array([[3, 1, 0], [1, 3, 4]])
+        order = VertexCache.fetch_point_order(triangles, 6)
+        # Point 2 and 5 are not used, so go on the end.
+        self.assertEqual(order.tolist(), [3, 1, 0, 4, 2, 5])
+
+    async def test_acmr_improves_on_shuffled_grid(self):
+        (points, triangles) = make_shuffled_grid(30)
+        triangles = np.array(triangles)
+        before = VertexCache.compute_acmr(triangles)
+        order = VertexCache.forsyth_triangle_order(triangles, len(points))
+        after = VertexCache.compute_acmr(triangles[order])
+        self.assertLess(after, before)
+        self.assertLess(after, 1.0)
+
+    async def test_optimize_keeps_mesh_consistent(self):
+        (points, triangles) = make_shuffled_grid(12)
+        mesh = make_mesh_maker(points, triangles)
+        mesh.add_blend_shape('shape', 'shape', mesh.old_to_new_point_indices(len(points)), [(i, 0.0, 1.0) for i in range(len(points))], None, None)
+        old_faces = {tuple(tuple(mesh.points[p]) for p in mesh.faceVertexIndices[f * 3:f * 3 + 3]) for f in range(len(triangles))}
+
+        (before, after) = mesh.optimize_vertex_cache()
+        self.assertLess(after, before)
+
+        # Same triangles (by position), each corner still has its own normal and st.
+        new_faces = {tuple(tuple(mesh.points[p]) for p in mesh.faceVertexIndices[f * 3:f * 3 + 3]) for f in range(len(triangles))}
+        self.assertEqual(new_faces, old_faces)
+        for f in range(len(triangles)):
+            source_face = mesh.source_faces[f]
+            self.assertEqual([n[0] for n in mesh.normals[f * 3:f * 3 + 3]], [source_face] * 3)
+            self.assertEqual([st[1] for st in mesh.st[f * 3:f * 3 + 3]], [0, 1, 2])
+            self.assertEqual(tuple(mesh.faceVertexIndices[f * 3:f * 3 + 3]),
+                             tuple(mesh.point_remap[p] for p in triangles[source_face]))
+
+        # Joints, point remap and blend shape offsets still line up with the points.
+        for (old, new) in mesh.point_remap.items():
+            self.assertEqual(tuple(mesh.points[new]), points[old])
+            self.assertEqual(mesh.skelJointIndices[new * 4], old)
+        (_, _, offsets, _, pointIndices) = mesh.blendShapes[0]
+        self.assertEqual(pointIndices.tolist(), sorted(pointIndices.tolist()))
+        for (offset, new) in zip(offsets.tolist(), pointIndices.tolist()):
+            self.assertEqual(mesh.skelJointIndices[new * 4], offset[0])
+
+    async def test_optimize_keeps_order_if_not_better(self):
+        # A small grid already in row order is better for the FIFO cache than the Forsyth order.
+        (points, triangles) = make_grid(7)
+        mesh = make_mesh_maker(points, triangles)
+        old_arrays = (list(mesh.points), list(mesh.faceVertexIndices), list(mesh.normals), list(mesh.skelJointIndices))
+
+        (before, after) = mesh.optimize_vertex_cache()
+        self.assertEqual(after, before)
+        self.assertEqual((mesh.points, mesh.faceVertexIndices, mesh.normals, mesh.skelJointIndices), old_arrays)